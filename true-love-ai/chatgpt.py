@@ -3,21 +3,36 @@
 import base64
 import json
 import logging
+import random
 import subprocess
 import time
 from datetime import datetime
-from io import BytesIO
+from threading import BoundedSemaphore, Lock, Thread
 from urllib.parse import quote_plus
 
 import httpx
 import requests
-from openai import OpenAI
+from openai import OpenAI, AuthenticationError, PermissionDeniedError, RateLimitError, APIConnectionError, \
+    InternalServerError
 
 from configuration import Config
+from prompt_cache import PromptCache, SingleFlight, normalize_prompt
 
 name = "chatgpt"
 openai_model = "gpt-4o"
-baidu_curl = ("curl --location 'https://www.baidu.com/s?wd=%s&tn=json' "
+gpt_error_answer = "An unknown error has occurred. Try again later."
+# 池子里每个key的耗时/成功率指数加权平均系数, 越大越看重最近的请求
+pool_ewma_alpha = 0.3
+# 池子里某个key连续失败这么多次就熔断, 冷却时间内不再选它(秒)
+pool_breaker_threshold = 3
+pool_breaker_cooldown = 60
+# 只有key本身或者网络出问题才算key不健康, 内容审核/图片太大这类用户请求导致的400不算
+# APITimeoutError是APIConnectionError的子类, stream读到一半断开是httpx的异常
+pool_failure_errors = (AuthenticationError, PermissionDeniedError, RateLimitError, APIConnectionError,
+                       InternalServerError, httpx.TransportError)
+# 百度搜索超时时间(秒), 超时当作没有搜到, 避免卡住当前请求线程
+baidu_timeout = 10
+baidu_curl = ("curl --location --max-time " + str(baidu_timeout) + " 'https://www.baidu.com/s?wd=%s&tn=json' "
               "--header 'User-Agent: Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1'")
 sd_url = "https://api.stability.ai/v2beta/stable-image/generate/ultra"
 sd_gen_url = "https://api.stability.ai/v2beta/stable-image/control/structure"
@@ -29,6 +44,16 @@ sd_url_map = {'gen_by_img': sd_gen_url,
               'replace_img': sd_replace_url,
               'remove_background_img': sd_remove_background_url
               }
+# sd请求共用连接池, 避免每次生图都重新tcp+tls握手
+sd_session = requests.Session()
+# 同时进行的sd请求上限, 低于账号的并发限制, 突发流量在本地排队而不是一起撞上429
+sd_concurrency = 4
+sd_semaphore = BoundedSemaphore(sd_concurrency)
+# sd请求的(连接, 读取)超时时间(秒), 卡住的连接不能一直占着并发名额
+sd_timeout = (5, 120)
+# 排队等sd并发名额的最长时间(秒), 等不到直接返回失败
+sd_acquire_timeout = 180
+sd_error_answer = "生成失败! 画图的人太多啦, 稍后再试试捏~"
 
 type_answer_call = [
     {"name": "type_answer",
@@ -96,6 +121,26 @@ def fetch_stream(ret, is_f=False):
     return rsp
 
 
+def is_json(text):
+    try:
+        json.loads(text)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def image_data_uri(img_data):
+    """
+    拼接给gpt看图用的data uri, 只解码开头几个字节判断图片格式, 不用整张图解码
+    """
+    try:
+        head = base64.b64decode(img_data[:16])
+    except (TypeError, ValueError):
+        head = b''
+    mime = 'image/jpeg' if head.startswith(b'\xff\xd8\xff') else 'image/png'
+    return f"data:{mime};base64,{img_data}"
+
+
 class ChatGPT:
 
     def __init__(self) -> None:
@@ -113,8 +158,11 @@ class ChatGPT:
             OpenAI(timeout=30, api_key=self.config.get("key2"), http_client=http_client),
             OpenAI(timeout=30, api_key=self.config.get("key3"), http_client=http_client),
         ]
-        # 轮训负载openai池子的计数器
-        self.count = 0
+        # openai池子每个key的耗时(ms)和成功率的指数加权平均, 用于按健康度加权挑选key
+        self.pool_stats = [{"ewma_ms": 1000.0, "success": 1.0, "consec_fails": 0, "open_until": 0.0}
+                           for _ in self.openai_pool]
+        # flask是多线程的, 更新统计是先读后写, 需要加锁
+        self.pool_stats_lock = Lock()
         # 对话历史容器
         self.conversation_list = {}
         # 提示词加载
@@ -124,72 +172,72 @@ class ChatGPT:
         self.system_content_msg4 = {"role": "system", "content": self.config.get("prompt4")}
         self.system_content_msg5 = {"role": "system", "content": self.config.get("prompt5")}
         self.system_content_msg6 = {"role": "system", "content": self.config.get("prompt6")}
+        # sd请求头只依赖配置里的key, 启动时构建一次
+        self.sd_headers = {
+            "authorization": f"Bearer {Config().PLATFORM_KEY['sd']}",
+            "accept": "application/json; type=image/"
+        }
+        # 图片意图分类缓存, 相同描述不再重复请求大模型
+        self.img_type_cache = PromptCache()
+        # 画图提示词缓存, 相同描述直接复用改写好的提示词
+        self.img_prompt_cache = PromptCache()
+        # 正在进行中的百度搜索, 相同关键词并发进来时只搜一次, 其他请求等同一个结果
+        self.baidu_single_flight = SingleFlight(wait_timeout=baidu_timeout + 5)
 
     def get_xun_wen(self, question):
         content = question.split("-")[1]
         return self.send_gpt_by_message([self.system_content_msg3, {"role": "user", "content": content}])
 
     def send_gpt_by_message(self, messages, function_call=None, functions=None):
+        openai_client = self.train_openai_client()
         try:
-
-            # 发送请求
-            ret = self.train_openai_client().chat.completions.create(
-                model=openai_model,
-                messages=messages,
-                temperature=0.2,
-                function_call=function_call,
-                functions=functions,
-                stream=True
-            )
-            # 获取stream查询
-            rsp = fetch_stream(ret, functions)
+            # 发送请求并获取stream查询
+            rsp = self.fetch_pool_stream(openai_client, functions,
+                                         model=openai_model,
+                                         messages=messages,
+                                         temperature=0.2,
+                                         function_call=function_call,
+                                         functions=functions)
         except Exception as e0:
-            rsp = "An unknown error has occurred. Try again later."
+            rsp = gpt_error_answer
             self.LOG.error(str(e0))
         return rsp
 
     def send_chatgpt(self, real_model, wxid, openai_client) -> dict:
         try:
-            # 发送请求
+            # 发送请求并获取stream查询
             question = self.conversation_list[wxid][-1]
-            ret = openai_client.chat.completions.create(
-                model=real_model,
-                messages=self.conversation_list[wxid],
-                temperature=0.2,
-                function_call={"name": "type_answer"},
-                functions=type_answer_call,
-                stream=True
-            )
-            # 获取stream查询
-            rsp_str = fetch_stream(ret, True)
+            rsp_str = self.fetch_pool_stream(openai_client, True,
+                                             model=real_model,
+                                             messages=self.conversation_list[wxid],
+                                             temperature=0.2,
+                                             function_call={"name": "type_answer"},
+                                             functions=type_answer_call)
             result = json.loads(rsp_str)
             rsp = result
-            self.LOG.info(f"openai result :{result}")
+            self.LOG.info("openai result :%s", result)
             if result['type'] == 'search':
                 # 先去百度获取数据
                 reference_list = self.fetch_refer_baidu(result)
                 logging.info(f"fetch_refer_baidu, result one:{reference_list[0] if reference_list else {} }")
                 # 构建临时prompt
                 refer_prompt = {"role": "assistant",
-                                "content": f"针对这个回答, 参考信息和来源链接如下: {json.dumps(reference_list)}"}
+                                "content": f"针对这个回答, 参考信息和来源链接如下: {json.dumps(reference_list, ensure_ascii=False)}"}
                 temp_prompt = {"role": "system",
                                "content": "下面你的回答必须结合上下文,因为上下文都是联网查询的,尤其是assistant的来源和参考链接，"
                                           "所以相当于你可以联网获取信息, 所以不允许说你不能联网, "
                                           "如果assistant的参考是一个空list, 你就说联网查询超时了, 引导用户再问一遍"
                                           "另外如果你不知道回答，请不要不要胡说. "
                                           "如果用户要求文章或者链接请你把最相关的参考链接给出(参考链接必须在上下文出现过)"}
-                # 然后再拿结果去问chatgpt
-                ret = openai_client.chat.completions.create(
-                    model=real_model,
-                    messages=self.conversation_list[wxid] + [refer_prompt, temp_prompt, question],
-                    temperature=0.2,
-                    stream=True
-                )
-                # 获取stream查询
-                rsp_str = fetch_stream(ret)
+                # 然后再拿结果去问chatgpt, 获取stream查询
+                rsp_str = self.fetch_pool_stream(openai_client,
+                                                 model=real_model,
+                                                 messages=self.conversation_list[wxid] + [refer_prompt, temp_prompt,
+                                                                                          question],
+                                                 temperature=0.2)
                 search_tail = f"\n- - - - - - - - - - - -\n\n🐾💩🕵：{result['answer']}"
                 rsp = {"type": "chat", "answer": rsp_str + search_tail}
-                self.LOG.info(f"openai+baidu:{rsp}")
+                self.LOG.info("openai+baidu:%s", rsp)
             self._update_message(wxid, rsp_str, "assistant")
         except Exception as e0:
             rsp = {"type": "chat", "answer": "发生未知错误, 稍后再试试捏"}
@@ -197,20 +245,29 @@ class ChatGPT:
         return rsp
 
     def fetch_refer_baidu(self, result):
+        keyword = result.get('answer', '')
+        try:
+            return self.baidu_single_flight.do(keyword, lambda: self._fetch_refer_baidu(result))
+        except Exception:
+            self.LOG.exception("等待百度搜索结果失败, keyword: %s", keyword)
+            return []
+
+    def _fetch_refer_baidu(self, result):
         reference_list = []
         try:
             send_curl = baidu_curl % quote_plus(result['answer'])
             self.LOG.info(f"need go to baidu search: {result['answer']}, curl:{send_curl}")
             baidu_response = subprocess.run(send_curl, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                            text=True)
+                                            text=True, timeout=baidu_timeout + 2)
             # 获取命令输出
             # 使用json.loads解析响应体
             data = json.loads(baidu_response.stdout)
-            # 使用列表推导式从每个entry中提取字段的值
+            # 使用列表推导式从每个entry中提取字段的值, 每个字段只取一次
+            entries = data['feed']['entry']
             reference_list = [
-                {"content": entry['abs'], "source_url": entry['url']}
-                for entry in data['feed']['entry']
-                if 'abs' in entry and 'url' in entry
+                {"content": abstract, "source_url": url}
+                for entry in entries
+                if (abstract := entry.get('abs')) is not None and (url := entry.get('url')) is not None
             ]
         except Exception:
             logging.exception(f"fetch_refer_baidu error, result:{result}")
@@ -257,24 +314,21 @@ class ChatGPT:
         try:
             start_time = time.time()
             self.LOG.info("get_analyze_by_img start")
-            ret = self.train_openai_client().chat.completions.create(
-                model='gpt-4o',
-                messages=[
-                    self.system_content_msg6,
-                    {"role": "user", "content": [
-                        {"type": "text", "text": content},
-                        {"type": "image_url", "image_url": {
-                            "url": f"data:image/png;base64,{img_data}"}
-                         }
-                    ]}
-                ],
-                temperature=0.2,
-                stream=True
-            )
+            # 发送请求并获取stream查询
+            result = self.fetch_pool_stream(openai_client,
+                                            model='gpt-4o',
+                                            messages=[
+                                                self.system_content_msg6,
+                                                {"role": "user", "content": [
+                                                    {"type": "text", "text": content},
+                                                    {"type": "image_url", "image_url": {
+                                                        "url": image_data_uri(img_data)}
+                                                     }
+                                                ]}
+                                            ],
+                                            temperature=0.2)
             cost = round(time.time() - start_time, 2)
             self.LOG.info(f"get_analyze_by_img cost:[{cost}ms]")
-            # 获取stream查询
-            result = fetch_stream(ret)
             # 更新返回值
             self._update_message(wxid, result, "assistant")
             if content.startswith('debug'):
@@ -288,105 +342,150 @@ class ChatGPT:
             raise
 
     def get_img_type(self, content):
+        cache_key = (normalize_prompt(content), openai_model)
         try:
-            start_time = time.time()
-            self.LOG.info("ds.img.typeAndPrompt start")
-            image_prompt = self.send_gpt_by_message(
-                messages=[
-                    self.system_content_msg5,
-                    {"role": "user", "content": content}
-                ],
-                function_call={"name": "img_type_answer_call"},
-                functions=img_type_answer_call,
-            )
-            self.LOG.info(f"ds.typeAndPrompt cost:[{(time.time() - start_time) * 1000}ms] result:{image_prompt}")
-            return image_prompt
+            # 只缓存能正常解析的结果, 出错的文案不缓存
+            return self.img_type_cache.get_or_load(cache_key, lambda: self._get_img_type(content), is_json)
         except Exception:
             self.LOG.exception(f"generate_typeAndPrompt error")
 
+    def _get_img_type(self, content):
+        start_time = time.time()
+        self.LOG.info("ds.img.typeAndPrompt start")
+        image_prompt = self.send_gpt_by_message(
+            messages=[
+                self.system_content_msg5,
+                {"role": "user", "content": content}
+            ],
+            function_call={"name": "img_type_answer_call"},
+            functions=img_type_answer_call,
+        )
+        self.LOG.info(f"ds.typeAndPrompt cost:[{(time.time() - start_time) * 1000}ms] result:{image_prompt}")
+        return image_prompt
+
     def get_img_by_img(self, content, img_data):
         # First get the image prompt
         image_prompt = content
 
-        # Re-generate the image based on the prompt
+        # Re-generate the image based on the prompt, 图片在拿sd并发名额之前就解码好
+        img = self.post_sd(sd_url_map.get(image_prompt["type"], sd_url),
+                           files={"image": base64.b64decode(img_data)},
+                           data={
+                               "prompt": image_prompt["answer"],
+                               "search_prompt": image_prompt["answer"],
+                               "control_strength": 0.7,
+                               "output_format": "png"
+                           })
+        return {"prompt": image_prompt["answer"], "img": img}
+
+    def post_sd(self, url, files, data) -> str:
+        """
+        请求sd生图, 返回base64编码的图片, 失败直接抛异常
+        """
         try:
             start_time = time.time()
             self.LOG.info("ds.img start")
-            response = requests.post(
-                sd_url_map.get(image_prompt["type"], sd_url),
-                headers={
-                    "authorization": f"Bearer {Config().PLATFORM_KEY['sd']}",
-                    "accept": "application/json; type=image/"
-                },
-                files={
-                    "image": BytesIO(base64.b64decode(img_data))
-                },
-                data={
-                    "prompt": image_prompt["answer"],
-                    "search_prompt": image_prompt["answer"],
-                    "control_strength": 0.7,
-                    "output_format": "png"
-                },
-            )
+            if not sd_semaphore.acquire(timeout=sd_acquire_timeout):
+                self.LOG.error("generate_image_with_sd 等待并发名额超时")
+                raise ValueError(sd_error_answer)
+            try:
+                response = sd_session.post(url, headers=self.sd_headers, files=files, data=data, timeout=sd_timeout)
+            finally:
+                sd_semaphore.release()
             self.LOG.info(f"ds.img cost:[{(time.time() - start_time) * 1000}ms]")
             if response.status_code == 200:
-                return {"prompt": image_prompt["answer"], "img": response.json()['image']}
-            else:
-                self.LOG.error(f"generate_image_with_sd not 200, result:{response.json()}")
-                raise ValueError("生成失败! 内容太不堪入目啦~")
+                return response.json()['image']
+            self.LOG.error("generate_image_with_sd not 200, status:%s, result:%s", response.status_code, response.text[:500])
+            raise ValueError("生成失败! 内容太不堪入目啦~")
         except requests.Timeout:
             self.LOG.error(f"generate_image_with_sd timeout")
-            raise
+            raise ValueError(sd_error_answer)
         except Exception:
             self.LOG.exception(f"generate_image_with_sd error")
             raise
 
+    @staticmethod
+    def warmup_sd():
+        # 只是为了提前建立到sd的连接放进连接池, 结果不重要
+        try:
+            sd_session.head("https://api.stability.ai", timeout=5)
+        except Exception:
+            pass
+
+    def _get_img_prompt(self, content):
+        # 缓存没命中才会走到这里, 等大模型生成提示词的同时提前和sd建立好连接, 后面生图直接复用
+        Thread(target=self.warmup_sd, name="WarmupSd", daemon=True).start()
+        start_time = time.time()
+        self.LOG.info("ds.img.prompt start")
+        image_prompt = self.send_gpt_by_message(messages=[
+            self.system_content_msg4,
+            {"role": "user", "content": content}
+        ])
+        self.LOG.info(f"ds.prompt cost:[{(time.time() - start_time) * 1000}ms]")
+        return image_prompt
+
     def get_img(self, content):
         # First get the image prompt
+        cache_key = (normalize_prompt(content), openai_model)
         image_prompt = ""
         try:
-            start_time = time.time()
-            self.LOG.info("ds.img.prompt start")
-            image_prompt = self.send_gpt_by_message(messages=[
-                self.system_content_msg4,
-                {"role": "user", "content": content}
-            ])
-            self.LOG.info(f"ds.prompt cost:[{(time.time() - start_time) * 1000}ms]")
+            image_prompt = self.img_prompt_cache.get_or_load(
+                cache_key, lambda: self._get_img_prompt(content),
+                lambda prompt: prompt and prompt != gpt_error_answer)
         except Exception:
             self.LOG.exception(f"generate_prompt error")
 
         # Re-generate the image based on the prompt
+        img = self.post_sd(sd_url,
+                           files={"none": ''},
+                           data={
+                               "prompt": image_prompt,
+                               "output_format": "jpeg",
+                               "aspect_ratio": "1:1"
+                           })
+        return {"prompt": image_prompt, "img": img}
+
+    def train_openai_client(self):
+        # 按 成功率/耗时 加权随机, 慢的或者一直失败的key会被自动少选, 恢复之后权重也会慢慢回来
+        # 熔断中的key先跳过, 全都熔断了就还是从整个池子里选, 不能一个都不给
+        now = time.time()
+        candidates = [i for i, stats in enumerate(self.pool_stats) if stats["open_until"] <= now]
+        if not candidates:
+            candidates = range(len(self.openai_pool))
+        weights = [max(self.pool_stats[i]["success"], 0.05) / self.pool_stats[i]["ewma_ms"] for i in candidates]
+        return self.openai_pool[random.choices(candidates, weights=weights)[0]]
+
+    def fetch_pool_stream(self, openai_client, is_f=False, **kwargs) -> str:
+        """
+        用池子里的client发起stream请求并读完结果, 结果记到这个key的健康度统计里, 失败继续往外抛
+        只有key或网络的问题才记失败, 用户内容导致的报错不影响key的健康度
+        """
+        start_time = time.time()
         try:
-            start_time = time.time()
-            self.LOG.info("ds.img start")
-            response = requests.post(sd_url,
-                                     headers={
-                                         "authorization": f"Bearer {Config().PLATFORM_KEY['sd']}",
-                                         "accept": "application/json; type=image/"
-                                     },
-                                     files={"none": ''},
-                                     data={
-                                         "prompt": image_prompt,
-                                         "output_format": "jpeg",
-                                         "aspect_ratio": "1:1"
-                                     },
-                                     )
-            self.LOG.info(f"ds.img cost:[{(time.time() - start_time) * 1000}ms]")
-            if response.status_code == 200:
-                return {"prompt": image_prompt, "img": response.json()['image']}
-            else:
-                self.LOG.error(f"generate_image_with_sd not 200, result:{response.json()}")
-                raise ValueError("生成失败! 内容太不堪入目啦~")
-        except requests.Timeout:
-            self.LOG.error(f"generate_image_with_sd timeout")
-            raise
-        except Exception:
-            self.LOG.exception(f"generate_image_with_sd error")
+            rsp = fetch_stream(openai_client.chat.completions.create(stream=True, **kwargs), is_f)
+        except pool_failure_errors:
+            self.record_pool_stats(openai_client, start_time, False)
             raise
+        self.record_pool_stats(openai_client, start_time, True)
+        return rsp
 
-    def train_openai_client(self):
-        self.count += 1
-        return self.openai_pool[self.count % 3]
+    def record_pool_stats(self, openai_client, start_time, success: bool) -> None:
+        stats = self.pool_stats[self.openai_pool.index(openai_client)]
+        cost = (time.time() - start_time) * 1000
+        with self.pool_stats_lock:
+            stats["success"] = pool_ewma_alpha * (1.0 if success else 0.0) + (1 - pool_ewma_alpha) * stats["success"]
+            if success:
+                # 耗时只统计成功的请求, 秒回401/429的key不能因为失败得快反而被多选
+                stats["ewma_ms"] = pool_ewma_alpha * cost + (1 - pool_ewma_alpha) * stats["ewma_ms"]
+                stats["consec_fails"] = 0
+                return
+            stats["consec_fails"] += 1
+            consec_fails = stats["consec_fails"]
+            if consec_fails >= pool_breaker_threshold:
+                stats["open_until"] = time.time() + pool_breaker_cooldown
+        if consec_fails >= pool_breaker_threshold:
+            self.LOG.warning("openai key ...%s 连续失败%s次, 熔断%s秒",
+                             openai_client.api_key[-4:], consec_fails, pool_breaker_cooldown)
 
 
 if __name__ == "__main__":
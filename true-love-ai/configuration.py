@@ -6,6 +6,12 @@ import os
 
 import yaml
 
+# 优先用libyaml的C解析器, 没装libyaml时退回纯python实现
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 # 设置日志文件夹的路径
 logs_dir = "logs"
 LOG = logging.getLogger("Configuration")
@@ -32,7 +38,7 @@ class Config:
         LOG.info("_load_config 开始刷新配置")
         # 如果这里有问题, 直接不让服务启动
         with open(config_path, "r", encoding='utf-8') as fp:
-            updated_config = yaml.safe_load(fp)
+            updated_config = yaml.load(fp, Loader=SafeLoader)
         LOG.info("_load_config 刷新配置成功: [%s]", updated_config)
         return updated_config
 
@@ -0,0 +1,99 @@
+import re
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+# 连续空白合并成一个空格
+whitespace_pattern = re.compile(r"\s+")
+# 首尾可以忽略的句读标点(中英文), 只去首尾; +#等符号和emoji会改变意思, 不能去
+edge_punctuation = " .,!?;:'\"，。！？；：、“”‘’…～~"
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    归一化提示词作为缓存key, 忽略大小写/多余空白/首尾标点的差异, 比如"画一只猫!"和"画一只猫"算同一个
+    """
+    return whitespace_pattern.sub(" ", text).strip(edge_punctuation).casefold() or text.strip()
+
+
+class SingleFlight:
+    """
+    相同key同时只跑一次loader, 并发进来的其他请求等同一个结果(或同一个异常), flask是多线程的所以加锁
+    """
+
+    def __init__(self, wait_timeout=60):
+        self.lock = Lock()
+        self.inflight = {}
+        self.wait_timeout = wait_timeout
+
+    def do(self, key, loader):
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[key] = future
+        if not owner:
+            return future.result(timeout=self.wait_timeout)
+        try:
+            value = loader()
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+
+class PromptCache:
+    """
+    有界的LRU缓存, 用于缓存相同提示词的大模型结果, flask是多线程的所以读写加锁
+    """
+
+    def __init__(self, capacity=512, wait_timeout=60):
+        self.cache = OrderedDict()
+        self.capacity = capacity
+        self.lock = Lock()
+        # 正在请求大模型的key, 相同key并发进来时只请求一次, 其他的等同一个结果
+        self.single_flight = SingleFlight(wait_timeout)
+
+    def get(self, key):
+        """
+        根据key获取value。如果key存在，将其移到最后（表示最近使用）。
+        """
+        with self.lock:
+            if key not in self.cache:
+                return None
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+    def put(self, key, value):
+        """
+        添加或更新键值对，并将其移到最后（表示最近使用）。
+        如果缓存超过最大容量，则移除最早的元素。
+        """
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            self.cache[key] = value
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)  # 移除最早的元素
+
+    def get_or_load(self, key, loader, cacheable=lambda value: True):
+        """
+        缓存命中直接返回, 否则调用loader加载; 同一个key同时只会有一个loader在跑
+        loader的结果满足cacheable才写入缓存, 出错的文案不缓存
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        def load():
+            value = loader()
+            if value is not None and cacheable(value):
+                self.put(key, value)
+            return value
+
+        return self.single_flight.do(key, load)
@@ -7,11 +7,18 @@ import sys
 
 import yaml
 
+# 优先用libyaml的C解析器, 没装libyaml时退回纯python实现
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 # 设置日志文件夹的路径
 logs_dir = "logs"
 
-# 修改 sys.stdout 的编码为 utf-8
-sys.stdout = open(sys.stdout.fileno(), mode='w', encoding='utf-8', buffering=1)
+# 修改 sys.stdout 的编码为 utf-8, 原地reconfigure, 不重新打开fd也不强制每行flush
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8')
 
 # 检查logs文件夹是否存在
 if not os.path.exists(logs_dir):
@@ -20,17 +27,23 @@ if not os.path.exists(logs_dir):
 
 
 class Config(object):
-    def __init__(self) -> None:
-        self.config = self._load_config()
-        self.set_logging()
-        self.master_wix = self.config["master_wix"]
-        self.http_token = self.config["http_token"]
+    _instance = None
+
+    def __new__(cls):
+        """new是魔法方法 实例化的时候会调用一次 用它来实现单例, 配置文件和日志只初始化一次"""
+        if cls._instance is None:
+            cls._instance = super(Config, cls).__new__(cls)
+            cls._instance.config = cls._load_config()
+            cls._instance.set_logging()
+            cls._instance.master_wix = cls._instance.config["master_wix"]
+            cls._instance.http_token = cls._instance.config["http_token"]
+        return cls._instance
 
     @staticmethod
     def _load_config() -> dict:
         pwd = os.path.dirname(os.path.abspath(__file__))
         with open(f"{pwd}/config.yaml", "rb") as fp:
-            config = yaml.safe_load(fp)
+            config = yaml.load(fp, Loader=SafeLoader)
         return config
 
     def set_logging(self) -> None:
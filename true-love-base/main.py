@@ -33,9 +33,10 @@ def main():
     server.enable_http(robot)
     # 加载小助手
     WcfUtils(wcf)
-    # 让服务保持不关闭
+    # 让服务保持不关闭, 主线程只是挂着等信号, 不用每秒醒一次;
+    # sleep在windows和linux下都能被ctrl+c打断, 不影响退出回调, 而无超时的Event.wait在windows下收不到ctrl+c
     while True:
-        time.sleep(1)
+        time.sleep(3600)
 
 
 if __name__ == '__main__':
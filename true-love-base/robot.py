@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import re
+import time
 from queue import Empty
 from threading import Thread
 
@@ -8,6 +10,13 @@ from wcferry import Wcf, WxMsg
 
 import server_client
 
+# 群里叫机器人的关键词, 一次正则扫描代替多次 in 判断
+at_me_pattern = re.compile(r"@真爱粉|zaf")
+# 查不到昵称的wxid多久之后才允许再查一次(秒), 避免每次回复都去查库
+missing_contact_retry = 600
+# 群成员昵称缓存最多存多少条, 超过后丢掉最早的
+room_contacts_capacity = 2000
+
 
 class Robot:
 
@@ -16,6 +25,10 @@ class Robot:
         self.LOG = logging.getLogger("Robot")
         self.wxid = self.wcf.get_self_wxid()
         self.allContacts = self.get_all_contacts()
+        # 群成员昵称是按群的, 不能放到全局联系人里: (room_id, wxid) -> 昵称
+        self.room_contacts = {}
+        # 查过但还是找不到昵称的(room_id, wxid) -> 上次查询时间
+        self.missing_contacts = {}
         self.LOG.info("真爱粉启动成功···")
 
     def forward_msg(self, msg: WxMsg) -> str:
@@ -24,25 +37,26 @@ class Robot:
 
     def enable_receiving_msg(self) -> None:
         def inner_process_msg(wcf: Wcf):
+            # 自己的wxid启动后不会变, 进循环前取一次
+            self_wxid = self.wxid
             while wcf.is_receiving_msg():
                 try:
                     msg = wcf.get_msg()
                     if 'weixin' in msg.sender:
                         continue
                     self.LOG.info("监听到消息:[%s]", msg)
-                    # 如果群消息,并且艾特,转发
-                    if msg.from_group() and (
-                            msg.is_at(wcf.self_wxid) or '@真爱粉' in msg.content or 'zaf' in msg.content):
-                        self.send_text_msg(self.forward_msg(msg), msg.roomid, msg.sender)
-                    # 如果是群消息 但是没有艾特, 直接过
+                    # 如果群消息,并且艾特,转发; 先做关键词扫描, 命中就不用再解析xml判断is_at
                     if msg.from_group():
+                        if at_me_pattern.search(msg.content) or msg.is_at(self_wxid):
+                            self.send_text_msg(self.forward_msg(msg), msg.roomid, msg.sender)
+                        # 如果是群消息 但是没有艾特, 直接过
                         continue
                     # 剩下的都是私聊消息, 默认全部转发
                     self.send_text_msg(self.forward_msg(msg), msg.sender)
                 except Empty:
                     continue  # Empty message
                 except Exception as e:
-                    self.LOG.error(f"Receiving message error: {e}")
+                    self.LOG.error("Receiving message error: %s", e)
 
         self.wcf.enable_receiving_msg()
         Thread(target=inner_process_msg, name="GetMessage", args=(self.wcf,), daemon=True).start()
@@ -72,17 +86,25 @@ class Robot:
         # msg 中需要有 @ 名单中一样数量的 @
         ats = ""
         if at_list:
+            # 这里偷个懒，直接 @昵称。有必要的话可以通过 MicroMsg.db 里的 ChatRoom 表，解析群昵称
+            # 一次join拼好, 不用循环里+=反复创建字符串
             wxids = at_list.split(",")
-            for wxid in wxids:
-                # 这里偷个懒，直接 @昵称。有必要的话可以通过 MicroMsg.db 里的 ChatRoom 表，解析群昵称
-                ats += f" @{self.allContacts.get(wxid, '')}"
+            contacts = self.allContacts
+            room_contacts = self.room_contacts
+            # 不是好友的群成员不在联系人里, 遇到没见过的wxid去查一下这个群的成员补上
+            now = time.time()
+            missing = [wxid for wxid in wxids if wxid not in contacts and (receiver, wxid) not in room_contacts
+                       and now - self.missing_contacts.get((receiver, wxid), 0) > missing_contact_retry]
+            if missing:
+                self.fill_missing_contacts(receiver, missing)
+            ats = "".join([" @" + (contacts.get(wxid) or room_contacts.get((receiver, wxid), '')) for wxid in wxids])
 
         # {msg}{ats} 表示要发送的消息内容后面紧跟@，例如 北京天气情况为：xxx @张三，微信规定需这样写，否则@不生效
         if ats == "":
-            self.LOG.info(f"给:[{receiver}], 发送:[{msg}]")
+            self.LOG.info("给:[%s], 发送:[%s]", receiver, msg)
             self.wcf.send_text(f"{msg}", receiver, at_list)
         else:
-            self.LOG.info(f"给:[{receiver}], 发送:[{ats}\r{msg}]")
+            self.LOG.info("给:[%s], 发送:[%s\r%s]", receiver, ats, msg)
             self.wcf.send_text(f"{ats}\n\n{msg}", receiver, at_list)
 
     def get_all_contacts(self) -> dict:
@@ -93,6 +115,28 @@ class Robot:
         contacts = self.wcf.query_sql("MicroMsg.db", "SELECT UserName, NickName FROM Contact;")
         return {contact["UserName"]: contact["NickName"] for contact in contacts}
 
+    def fill_missing_contacts(self, room_id: str, wxids: list) -> None:
+        """
+        用群成员昵称补上联系人里没有的wxid, 按群缓存; 还是查不到的记下来, 一段时间内不再重复查
+        """
+        members = {}
+        if room_id.endswith("@chatroom"):
+            try:
+                members = self.get_contacts_by_room_id(room_id) or {}
+            except Exception as e:
+                self.LOG.error("获取群成员失败, room_id: %s, error: %s", room_id, e)
+        now = time.time()
+        # 过了重试时间的记录已经没用了, 顺便清掉, 不让它一直涨
+        self.missing_contacts = {key: ts for key, ts in self.missing_contacts.items()
+                                 if now - ts <= missing_contact_retry}
+        for wxid in wxids:
+            if wxid in members:
+                self.room_contacts[(room_id, wxid)] = members[wxid]
+            else:
+                self.missing_contacts[(room_id, wxid)] = now
+        while len(self.room_contacts) > room_contacts_capacity:
+            del self.room_contacts[next(iter(self.room_contacts))]
+
     def get_contacts_by_room_id(self, room_id) -> dict:
         """获取群成员
          Args:
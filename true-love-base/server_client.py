@@ -14,6 +14,9 @@ circuit_breaker = {
 
 host = "http://localhost:8088"
 text_url = f"{host}/get-chat"
+# 每条消息都会请求server, 共用连接池复用keep-alive连接
+server_session = requests.Session()
+server_session.headers.update({'Content-Type': 'application/json'})
 LOG = logging.getLogger("ServerClient")
 
 
@@ -39,9 +42,6 @@ def get_chat(req: WxMsg):
             # "extra": req.extra,
             "refer_chat": refer_chat.to_dict() if refer_chat else None
         })
-        headers = {
-            'Content-Type': 'application/json'
-        }
 
         # 暂不检查熔断器, 只是做文案分流
         # current_time = int(time.time())
@@ -51,13 +51,13 @@ def get_chat(req: WxMsg):
         # 发起请求
         start_time = time.time()
         LOG.info("开始请求server获取内容, req:[%s]", payload)
-        response = requests.request("POST", text_url, headers=headers, data=payload, timeout=(2, 60))
-        LOG.info("接收到server返回值, cost:[%.0fms], res:[%s]", (time.time() - start_time) * 1000, response.json())
+        response = server_session.post(text_url, data=payload, timeout=(2, 60))
         # 检查HTTP响应状态
         response.raise_for_status()
 
         # 解析响应
         return_data = response.json()
+        LOG.info("接收到server返回值, cost:[%.0fms], res:[%s]", (time.time() - start_time) * 1000, return_data)
         if return_data.get("code") == 0:
             # 成功返回 重置熔断器状态
             circuit_breaker["fail_count"] = 0
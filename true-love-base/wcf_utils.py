@@ -2,6 +2,7 @@ import json
 import logging
 import os
 import pathlib
+import random
 import re
 import sys
 import time
@@ -13,6 +14,12 @@ from typing import Any
 from wcferry import WxMsg
 
 TEMP_DIR = 'files-save'
+# BytesExtra里文件路径的多种pattern, 模块加载时编译一次
+EXTRA_PATH_PATTERNS = (
+    re.compile(b'\x08\x04\x12.(.*?)\x1a'),  # 图片, 自己发的文件
+    re.compile(b'\x08\x04\x12.(.*?)$'),  # 文件
+)
+IMAGE_MAIN_NAME_PATTERN = re.compile(r'/([^/]+)\.[^\.]+$')
 LOG = logging.getLogger("wcf_utils")
 
 
@@ -59,6 +66,7 @@ class ContentType(Enum):
 
 class ChatMsg:
     """ 代表某种类型的消息, 用于内部数据传递 """
+    __slots__ = ("type", "content")
 
     def __init__(self, type: ContentType, content: str) -> None:
         """ 初始化
@@ -86,15 +94,13 @@ class WcfUtils:
     wcf = None
 
     def __new__(cls, wcf=None):
-        if cls._instance is None:
-            cls._instance = super(WcfUtils, cls).__new__(cls)
-            cls._instance.__init_once(wcf)
-        return cls._instance
-
-    def __init_once(self, wcf):
-        if not hasattr(self, 'initialized'):  # 防止重复初始化
-            self.wcf = wcf
-            self.initialized = True
+        # _instance只在第一次为空, 初始化只会走一次, 不用再hasattr判断
+        instance = cls._instance
+        if instance is None:
+            instance = super(WcfUtils, cls).__new__(cls)
+            instance.wcf = wcf
+            cls._instance = instance
+        return instance
 
     def get_video(self, msgid: str, extra: str) -> str:
         """ 下载消息附件（视频、文件）
@@ -264,14 +270,9 @@ class WcfUtils:
         bextra = msg_data.get('BytesExtra')
 
         # 多种pattern搜索
-        patterns = [
-            b'\x08\x04\x12.(.*?)\x1a',  # 图片
-            b'\x08\x04\x12.(.*?)$',  # 文件
-            b'\x08\x04\x12.(.*?)\x1a'  # 自己发的文件
-        ]
         match = None
-        for p in patterns:
-            match = re.compile(p).search(bextra)
+        for p in EXTRA_PATH_PATTERNS:
+            match = p.search(bextra)
             if match:
                 break
         if not match:
@@ -306,8 +307,7 @@ class WcfUtils:
         """
 
         # 获得文件主名
-        pattern = r'/([^/]+)\.[^\.]+$'
-        match = re.search(pattern, extra)
+        match = IMAGE_MAIN_NAME_PATTERN.search(extra)
         if not match:
             return None
         main_name = match.group(1)
@@ -323,15 +323,16 @@ class WcfUtils:
             return dl_file
         return None
 
-    def download_with_retries(self, msgid, extra, temp_dir, max_retries=3, delay=2):
-        """下载文件并重试指定次数
+    def download_with_retries(self, msgid, extra, temp_dir, max_retries=3, delay=0.5, max_delay=4):
+        """下载文件并重试指定次数, 重试间隔指数退避并带随机抖动
 
         Args:
             msgid: 消息ID
             extra: 附加信息
             temp_dir: 临时目录
             max_retries: 最大重试次数
-            delay: 重试前的等待时间（秒）
+            delay: 第一次重试前的等待时间（秒）, 之后每次翻倍
+            max_delay: 重试等待时间上限（秒）
 
         Returns:
             下载的文件路径或 None 如果下载失败
@@ -344,8 +345,10 @@ class WcfUtils:
             if dl_file:
                 return dl_file
             attempt += 1
+            if attempt >= max_retries:
+                break
             LOG.warning(f"下载失败，正在重试 {attempt}/{max_retries}...")
-            time.sleep(delay)
+            time.sleep(min(max_delay, delay * 2 ** (attempt - 1)) + random.uniform(0, 0.2))
 
         LOG.error("下载失败，所有重试均已失败")
         return None
@@ -3,8 +3,13 @@ import hashlib
 import hmac
 import json
 import logging
+import os
+import random
 import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
+from threading import Lock
 
 import requests
 
@@ -18,6 +23,25 @@ ASR_APPID = config.ASR['asr_appid']
 ASR_SECRET_ID = config.ASR['asr_secret_id']
 ASR_SECRET_KEY = config.ASR['asr_secret_key']
 endpoint = "asr.tencentcloudapi.com"
+# 提交和轮询都打到同一个域名, 共用连接池复用keep-alive连接, 每次轮询不用重新TLS握手
+asr_session = requests.Session()
+# 语音识别结果缓存, key为音频内容的sha256, 同一条语音被反复引用时不用再提交识别任务
+asr_cache_capacity = 256
+asr_cache = OrderedDict()
+asr_cache_lock = Lock()
+# 正在识别中的音频, 同一段音频同时被多次请求时只提交一次识别, 其余的等结果
+asr_inflight = {}
+asr_inflight_lock = Lock()
+# 一句话识别同步返回结果, 只支持3MB/60s以内的音频, 微信语音基本都在这个范围内
+sentence_max_bytes = 3 * 1024 * 1024
+# 文件后缀 -> 接口的VoiceFormat, 大部分同名, ogg文件对应接口的ogg-opus(不是opus编码的接口会报错, 走兜底)
+sentence_voice_formats = {'wav': 'wav', 'pcm': 'pcm', 'ogg': 'ogg-opus', 'speex': 'speex', 'silk': 'silk',
+                          'mp3': 'mp3', 'm4a': 'm4a', 'aac': 'aac', 'amr': 'amr'}
+# 一句话识别和提交识别任务都要上传整段音频, (连接, 读取)超时给宽一点; 一句话识别超时就走录音文件识别兜底
+sentence_timeout = (5, 30)
+# 轮询单次请求的(连接, 读取)超时, 以及整体最多等多久; 签名5分钟过期, 整体等待不能超过这个时间
+poll_timeout = (3, 10)
+poll_max_wait = 180
 
 
 def get_signature(secret_key, date, service, string_to_sign):
@@ -103,6 +127,56 @@ def get_submit_headers(service, method, endpoint, payload):
     return headers
 
 
+def get_sentence_headers(service, method, endpoint, payload):
+    headers = {
+        "X-Tc-Host": endpoint,
+        "X-Tc-Timestamp": str(int(time.time())),
+        "X-Tc-Action": "SentenceRecognition",
+        "X-Tc-Version": "2019-06-14",
+        "X-Tc-Region": "ap-guangzhou",
+        "content-type": "application/json; charset=utf-8",
+        "Host": endpoint,
+    }
+    headers["Authorization"] = get_auth_header(ASR_SECRET_ID, ASR_SECRET_KEY, service, method, endpoint, payload,
+                                               headers)
+    return headers
+
+
+def sentence_recognition(audio_file_path):
+    """
+    一句话识别, 一次请求直接拿到结果, 不用提交任务再轮询
+
+    Returns:
+        str: 识别文本, 格式不支持/音频太大/接口报错时返回None, 由调用方走录音文件识别兜底
+    """
+    voice_format = sentence_voice_formats.get(os.path.splitext(audio_file_path)[1].lstrip('.').lower())
+    if not voice_format or os.path.getsize(audio_file_path) > sentence_max_bytes:
+        return None
+    try:
+        with open(audio_file_path, "rb") as f:
+            audio_data = f.read()
+        service = "asr"
+        method = "POST"
+        params = {
+            "EngSerViceType": "16k_zh-PY",
+            "SourceType": 1,
+            "VoiceFormat": voice_format,
+            "Data": base64.b64encode(audio_data).decode('utf-8'),
+            "DataLen": len(audio_data),
+        }
+        payload = json.dumps(params)
+        headers = get_sentence_headers(service, method, endpoint, payload)
+        response = asr_session.post(f"https://{endpoint}/", headers=headers, data=payload, timeout=sentence_timeout)
+        result = response.json().get("Response", {})
+        if result.get("Error"):
+            logging.info(f"sentence_recognition error, fallback to rec task:{result.get('Error')}")
+            return None
+        return result.get("Result")
+    except Exception:
+        logging.exception("sentence_recognition error, fallback to rec task")
+        return None
+
+
 def upload_audio(audio_file_path):
     with open(audio_file_path, "rb") as f:
         audio_data = f.read()
@@ -117,20 +191,77 @@ def upload_audio(audio_file_path):
     }
     payload = json.dumps(params)
     headers = get_submit_headers(service, method, endpoint, payload)
-    response = requests.post(f"https://{endpoint}/", headers=headers, data=payload)
+    response = asr_session.post(f"https://{endpoint}/", headers=headers, data=payload, timeout=sentence_timeout)
     return response.json()
 
 
+def file_digest(audio_file_path):
+    with open(audio_file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_cached_asr(digest):
+    with asr_cache_lock:
+        if digest not in asr_cache:
+            return None
+        asr_cache.move_to_end(digest)
+        return asr_cache[digest]
+
+
+def put_cached_asr(digest, result):
+    with asr_cache_lock:
+        asr_cache[digest] = result
+        asr_cache.move_to_end(digest)
+        if len(asr_cache) > asr_cache_capacity:
+            asr_cache.popitem(last=False)
+
+
 def do_asr(audio_file_path):
+    try:
+        digest = file_digest(audio_file_path)
+        cached = get_cached_asr(digest)
+        if cached is not None:
+            logging.info(f"do_asr hit cache digest:{digest}")
+            return cached
+        with asr_inflight_lock:
+            future = asr_inflight.get(digest)
+            owner = future is None
+            if owner:
+                future = Future()
+                asr_inflight[digest] = future
+        if not owner:
+            logging.info(f"do_asr same audio in flight, wait for result digest:{digest}")
+            return future.result(timeout=poll_max_wait + 30)
+        result = "语言识别失败, 让用户再试一次"
+        try:
+            result = _do_asr(audio_file_path, digest)
+        finally:
+            future.set_result(result)
+            with asr_inflight_lock:
+                del asr_inflight[digest]
+        return result
+    except Exception:
+        logging.exception("do_asr error")
+        return "语言识别失败, 让用户再试一次"
+
+
+def _do_asr(audio_file_path, digest):
     try:
         start_time = time.time()
-        task_info = upload_audio(audio_file_path)
-        logging.info(f"do_asr submit success cost:{int(time.time() - start_time)} task:{task_info}")
-        if task_info.get('Response').get('Error'):
-            return f"语言识别失败, 请让用户再试一次, 理由是: f{task_info.get('Response').get('Error').get('Message')}"
-        start_time = time.time()
-        result = get_result(task_info.get('Response').get('Data').get('TaskId'))
-        logging.info(f"do_asr result success cost:{int(time.time() - start_time)} result:{result}")
+        result = sentence_recognition(audio_file_path)
+        if result is not None:
+            logging.info(f"do_asr sentence success cost:{int(time.time() - start_time)} result:{result}")
+        else:
+            task_info = upload_audio(audio_file_path)
+            logging.info(f"do_asr submit success cost:{int(time.time() - start_time)} task:{task_info}")
+            if task_info.get('Response').get('Error'):
+                return f"语言识别失败, 请让用户再试一次, 理由是: f{task_info.get('Response').get('Error').get('Message')}"
+            start_time = time.time()
+            result = get_result(task_info.get('Response').get('Data').get('TaskId'))
+            logging.info(f"do_asr result success cost:{int(time.time() - start_time)} result:{result}")
+        # 识别失败的不缓存, 用户重试的时候还能再识别一次
+        if isinstance(result, str) and not result.startswith("语言识别失败"):
+            put_cached_asr(digest, result)
         return result
     except Exception:
         logging.exception("do_asr error")
@@ -152,13 +283,23 @@ def get_result_headers(service, method, endpoint, payload):
     return headers
 
 
-def get_result(task_id, polling_interval=2):
+def next_poll_delay(attempt, base_interval=0.5, max_interval=8.0):
+    """
+    指数退避的轮询间隔: 0.5s, 1s, 2s ... 最多max_interval秒, 再加一点随机抖动
+    短语音很快就识别完, 前几次间隔短能更快拿到结果, 长任务后面也不会一直刷接口
+    """
+    return min(max_interval, base_interval * 2 ** attempt) + random.uniform(0, 0.3)
+
+
+def get_result(task_id, base_interval=0.5, max_interval=8.0, max_wait=poll_max_wait):
     """
     根据TaskId轮询获取语音识别结果
 
     Args:
         task_id (str): 语音识别任务ID
-        polling_interval (int): 轮询间隔时间(秒)
+        base_interval (float): 第一次轮询间隔时间(秒), 之后指数增加
+        max_interval (float): 轮询间隔时间上限(秒)
+        max_wait (float): 整体最多轮询多久(秒), 超过就放弃
 
     Returns:
         dict: 语音识别结果,包含识别文本和其他信息
@@ -171,18 +312,40 @@ def get_result(task_id, polling_interval=2):
     method = "POST"
     headers = get_result_headers(service, method, endpoint, payload)
 
+    deadline = time.time() + max_wait
+    attempt = 0
     while True:
+        if time.time() > deadline:
+            logging.error(f"asr get_result timeout after {max_wait}s, task_id:{task_id}")
+            return "语言识别失败, 让用户再试一次"
         try:
             # 发送GET请求获取结果
-            response = requests.post(f"https://{endpoint}/", data=payload, headers=headers)
+            response = asr_session.post(f"https://{endpoint}/", data=payload, headers=headers, timeout=poll_timeout)
             # 解析响应数据
             result = response.json()
+            # 鉴权失败/TaskId不对/限流等接口报错直接返回失败, 不要当成还在识别中一直轮询到超时
+            error = result.get("Response", {}).get("Error")
+            if error:
+                logging.error(f"asr get_result error:{error}")
+                return f"语言识别失败, 请让用户再试一次, 理由是: {error.get('Message')}"
+            data = result.get("Response", {}).get("Data") or {}
+            status = data.get("Status")
             # 如果任务已完成,返回结果
-            if result.get("Response", {}).get("Data").get("Status") == 2:
-                return result.get("Response", {}).get("Data").get("Result")
+            if status == 2:
+                return data.get("Result")
+            # 任务失败了就不用再轮询了
+            if status == 3:
+                logging.error(f"asr get_result task failed:{result}")
+                return "语言识别失败, 让用户再试一次"
             # 如果任务正在进行中,等待一段时间后继续轮询
             logging.info(f"获取结果为{result}, 等待下一次重试")
-            time.sleep(polling_interval)
+            time.sleep(next_poll_delay(attempt, base_interval, max_interval))
+            attempt += 1
+        except requests.Timeout:
+            # 单次请求超时不算失败, 退避一下继续轮询, 由deadline兜底
+            logging.warning(f"asr get_result request timeout, retry attempt:{attempt}")
+            time.sleep(next_poll_delay(attempt, base_interval, max_interval))
+            attempt += 1
         except Exception:
             logging.exception("asr get_result error")
             return "语言识别失败, 让用户再试一次"
@@ -11,6 +11,9 @@ host = config.BASE_SERVER["host"]
 text_url = f"{host}/send/text"
 text_img = f"{host}/send/img"
 get_by_room_id_url = f"{host}/get/by/room-id"
+# 推送消息都打到base, 共用连接池复用keep-alive连接; 请求头都是固定的, 设置在session上
+base_session = requests.Session()
+base_session.headers.update({'Content-Type': 'application/json'})
 LOG = logging.getLogger("BaseClient")
 
 
@@ -20,13 +23,10 @@ def send_text(send_receiver, at_receiver, content):
         "atReceiver": at_receiver,
         "content": content
     })
-    headers = {
-        'Content-Type': 'application/json'
-    }
     try:
         start_time = time.time()
         LOG.info("开始请求base推送text内容, req:[%s]", payload)
-        res = requests.request("POST", text_url, headers=headers, data=payload, timeout=(2, 60))
+        res = base_session.post(text_url, data=payload, timeout=(2, 60))
         # 检查HTTP响应状态
         res.raise_for_status()
         LOG.info("请求成功, cost:[%.0fms], res:[%s]", (time.time() - start_time) * 1000, res.json())
@@ -40,14 +40,10 @@ def send_img(path, send_receiver):
         "path": path,
         "sendReceiver": send_receiver,
     })
-    headers = {
-        'Content-Type': 'application/json'
-    }
-
     try:
         start_time = time.time()
         LOG.info("开始请求base推送img内容, req:[%s]", payload[:200])
-        res = requests.request("POST", text_img, headers=headers, data=payload, timeout=(2, 60))
+        res = base_session.post(text_img, data=payload, timeout=(2, 60))
         # 检查HTTP响应状态
         res.raise_for_status()
         LOG.info("send_img请求成功, cost:[%.0fms], res:[%s]", (time.time() - start_time) * 1000, res.json())
@@ -60,13 +56,10 @@ def get_by_room_id(room_id) -> dict:
     payload = json.dumps({
         "room_id": room_id,
     })
-    headers = {
-        'Content-Type': 'application/json'
-    }
     try:
         start_time = time.time()
         LOG.info("开始请求get_all内容")
-        res = requests.request("POST", get_by_room_id_url, headers=headers, data=payload, timeout=(2, 60))
+        res = base_session.post(get_by_room_id_url, data=payload, timeout=(2, 60))
         # 检查HTTP响应状态
         res.raise_for_status()
         LOG.info("get_all请求成功, cost:[%.0fms], res:[%s]", (time.time() - start_time) * 1000, res.json())
@@ -21,6 +21,12 @@ class ChatMsgHandler:
         self.LOG.info("self.chatbot配置为空, 但是调用了get_answer方法")
         return ""
 
+    def get_asr_answer(self, question: str, audio_path: str, wxid: str, sender: str) -> str:
+        if self.chatbot:
+            return self.chatbot.async_get_asr_answer(question, audio_path, wxid, sender)
+        self.LOG.info("self.chatbot配置为空, 但是调用了get_asr_answer方法")
+        return ""
+
     def gen_img(self, question: str, wxid: str, sender: str) -> str:
         if self.chatbot:
             return self.chatbot.async_gen_img(question, wxid, sender)
@@ -7,6 +7,7 @@ import logging
 import os
 import random
 import time
+import uuid
 from concurrent import futures
 from datetime import datetime
 
@@ -14,20 +15,29 @@ import requests
 
 import base_client
 import context_vars
+from asr_utils import do_asr
 from configuration import Config
 
 executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+# 请求ai服务共用连接池, 复用keep-alive连接, 不用每次都重新握手
+ai_session = requests.Session()
+ai_session.headers.update({'Content-Type': 'application/json'})
+ai_host = 'https://notice.someget.work'
+llm_url = f"{ai_host}/get-llm"
+gen_img_url = f"{ai_host}/gen-img"
+img_type_url = f"{ai_host}/get-img-type"
+analyze_url = f"{ai_host}/get-analyze"
 
 name = "chatgpt"
+# 生成图片的保存目录, 项目目录下的sd-img
+sd_img_directory = os.path.dirname(os.path.abspath(__file__)) + '/sd-img/'
 
 
 def get_file_path(msg_id):
-    project_directory = os.path.dirname(os.path.abspath(__file__))
-    download_directory = project_directory + '/sd-img/'
-    # 构建唯一文件名
-    local_filename = f'{msg_id if msg_id else str(time.time())}.png'
+    # 构建唯一文件名, 没有消息id时用uuid, 并发生图也不会撞名
+    local_filename = f'{msg_id or uuid.uuid4().hex}.png'
     # 构建完整的文件路径
-    return os.path.join(download_directory, local_filename)
+    return os.path.join(sd_img_directory, local_filename)
 
 
 # 抽象接口
@@ -52,12 +62,8 @@ class ChatGPT(ChatBot):
                 "sender": sender,
             }
 
-            # 请求配置
-            url = 'https://notice.someget.work/get-llm'
-            headers = {'Content-Type': 'application/json'}
-
             # 发送请求
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = ai_session.post(llm_url, data=json.dumps(data))
 
             # 获取结果
             rsp = response.json().get('data')
@@ -79,14 +85,11 @@ class ChatGPT(ChatBot):
                 "img_data": image_to_base64(img_path),
             }
 
-            # 请求配置
-            url = 'https://notice.someget.work/gen-img'
-            headers = {'Content-Type': 'application/json'}
-
             # 发送请求
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = ai_session.post(gen_img_url, data=json.dumps(data))
             # 获取结果
-            rsp = response.json().get('data') or response.json().get('message')
+            rsp_json = response.json()
+            rsp = rsp_json.get('data') or rsp_json.get('message')
         except Exception as e0:
             self.LOG.error("发送到sd出错", e0)
             rsp = '发生未知错误, 稍后再试试捏'
@@ -100,16 +103,13 @@ class ChatGPT(ChatBot):
                 "content": question
             }
 
-            # 请求配置
-            url = 'https://notice.someget.work/get-img-type'
-            headers = {'Content-Type': 'application/json'}
-
             # 发送请求
             start_time = time.time()
             self.LOG.info("开始发送给get_img_type")
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = ai_session.post(img_type_url, data=json.dumps(data))
             # 获取结果
-            rsp = response.json().get('data') or response.json().get('message')
+            rsp_json = response.json()
+            rsp = rsp_json.get('data') or rsp_json.get('message')
             self.LOG.info(f"get_img_type回答时间为：{round(time.time() - start_time, 2)}s, result:{rsp}")
         except Exception as e0:
             self.LOG.error("发送到sd出错", e0)
@@ -127,14 +127,11 @@ class ChatGPT(ChatBot):
                 "img_data": image_to_base64(img_path),
             }
 
-            # 请求配置
-            url = 'https://notice.someget.work/get-analyze'
-            headers = {'Content-Type': 'application/json'}
-
             # 发送请求
-            response = requests.post(url, headers=headers, data=json.dumps(data))
+            response = ai_session.post(analyze_url, data=json.dumps(data))
             # 获取结果
-            rsp = response.json().get('data') or response.json().get('message')
+            rsp_json = response.json()
+            rsp = rsp_json.get('data') or rsp_json.get('message')
         except Exception as e0:
             self.LOG.error("发送到send_analyze出错", e0)
             rsp = '发生未知错误, 稍后再试试捏'
@@ -172,6 +169,18 @@ class ChatGPT(ChatBot):
         # 这里先固定回复
         return ""
 
+    def get_asr_answer(self, question: str, audio_path: str, wxid: str, sender: str):
+        # 先语音识别再走ai, 有question说明是引用的语音, 拼接到问题后面
+        asr_text = do_asr(audio_path)
+        if question:
+            asr_text = f"{question}, quoted asr recognition content content:{asr_text}"
+        self.get_answer(asr_text, wxid, sender)
+
+    def async_get_asr_answer(self, question: str, audio_path: str, wxid: str, sender: str) -> str:
+        # 语音识别要提交任务等结果, 和ai回答一起丢到线程池里, 不阻塞消息接收
+        executor.submit(self.get_asr_answer, question, audio_path, wxid, sender)
+        return ""
+
     def async_gen_img(self, question: str, wxid: str, sender: str) -> str:
         # 这里异步调用方法
         executor.submit(self.gen_img, question, wxid, sender, '', context_vars.local_msg_id.get(''))
@@ -180,17 +189,25 @@ class ChatGPT(ChatBot):
         return ""
 
     def async_gen_img_by_img(self, question: str, img_path: str, wxid: str, sender: str) -> str:
-        result = json.loads(self.get_img_type(question))
-        if 'type' in result and result['type'] == 'analyze_img':
-            executor.submit(self.gen_analyze, question, wxid, sender, img_path)
-            base_client.send_text(wxid, sender, "🔍让我仔细瞧瞧，请耐心等待")
-            return ""
-        # 其他都是改图
-        executor.submit(self.gen_img, result, wxid, sender, img_path, context_vars.local_msg_id.get(''))
-        # 这里先固定回复
-        base_client.send_text(wxid, sender, "🚀您的作品将在1~10分钟左右完成，请耐心等待")
+        # 判断类型也要调一次大模型, 一起丢到线程池里, 不阻塞消息接收
+        executor.submit(self.gen_img_by_img, question, img_path, wxid, sender, context_vars.local_msg_id.get(''))
         return ""
 
+    def gen_img_by_img(self, question, img_path, wxid, sender, msg_id=''):
+        # 在线程池里跑, future没人取, 异常必须在这里兜住并回复用户, 不然会被静默吞掉
+        try:
+            result = json.loads(self.get_img_type(question))
+            if 'type' in result and result['type'] == 'analyze_img':
+                base_client.send_text(wxid, sender, "🔍让我仔细瞧瞧，请耐心等待")
+                self.gen_analyze(question, wxid, sender, img_path)
+                return
+            # 其他都是改图, 这里先固定回复
+            base_client.send_text(wxid, sender, "🚀您的作品将在1~10分钟左右完成，请耐心等待")
+            self.gen_img(result, wxid, sender, img_path, msg_id)
+        except Exception:
+            self.LOG.exception("gen_img_by_img error")
+            base_client.send_text(wxid, sender, '发生未知错误, 稍后再试试捏')
+
     def gen_img(self, question, wxid, sender, img_path='', msg_id=''):
         start_time = time.time()
         self.LOG.info(f"开始发送给sd生图, img_path={img_path[:10]}")
@@ -7,8 +7,15 @@ import sys
 
 import yaml
 
-# 修改 sys.stdout 的编码为 utf-8
-sys.stdout = open(sys.stdout.fileno(), mode='w', encoding='utf-8', buffering=1)
+# 优先用libyaml的C解析器, 没装libyaml时退回纯python实现
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# 修改 sys.stdout 的编码为 utf-8, 原地reconfigure, 不重新打开fd也不强制每行flush
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8')
 
 # 设置日志文件夹的路径
 logs_dir = "logs"
@@ -36,7 +43,7 @@ class Config:
         LOG.info("_load_config 开始刷新配置")
         # 如果这里有问题, 直接不让服务启动
         with open(config_path, "r", encoding='utf-8') as fp:
-            updated_config = yaml.safe_load(fp)
+            updated_config = yaml.load(fp, Loader=SafeLoader)
         LOG.info("_load_config 刷新配置成功: [%s]", updated_config)
         return updated_config
 
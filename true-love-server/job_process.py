@@ -2,14 +2,16 @@ import concurrent
 import functools
 import logging
 import os
+import random
 import re
 import time
-import urllib.request
 from concurrent import futures
 from datetime import datetime
 
 import pytz
 import requests
+from PIL import Image
+from bs4 import BeautifulSoup
 
 import base_client
 from configuration import Config
@@ -22,6 +24,7 @@ executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
 config = Config().GROUPS.get("auto_notice", {})
 test_room_ids: list = config.get("test")
 LOG = logging.getLogger("JobProcess")
+number_pattern = re.compile(r'\d+\.\d+|\d+')
 
 
 def log_function_execution(func):
@@ -44,7 +47,7 @@ def log_function_execution(func):
 def notice_mei_yuan():
     room_ids: list = config.get("notice_mei_yuan")
     rsp = trig_search_handler.run("查询美元汇率")
-    numbers = re.findall('\d+\.\d+|\d+', rsp)
+    numbers = number_pattern.findall(rsp)
     LOG.info(numbers)
     if len(numbers) > 2 and float(numbers[2]) <= 700:
         for room_id in room_ids:
@@ -56,9 +59,13 @@ def notice_mei_yuan():
 @log_function_execution
 def notice_library_schedule():
     room_ids: list = config.get("notice_library_schedule")
-    rsp = trig_search_handler.run("查询图书馆时间")
-    rsp2 = trig_search_handler.run("查询美元汇率")
-    rsp3 = trig_search_handler.run("查询gym时间")
+    # 三个查询互不依赖, 并发去爬, 总耗时取最慢的那个而不是三个相加
+    library_future = executor.submit(trig_search_handler.run, "查询图书馆时间")
+    currency_future = executor.submit(trig_search_handler.run, "查询美元汇率")
+    gym_future = executor.submit(trig_search_handler.run, "查询gym时间")
+    rsp = library_future.result()
+    rsp2 = currency_future.result()
+    rsp3 = gym_future.result()
     msg = "早上好☀️宝子们，\n\n"
     if rsp != "": msg = msg + "今日图书馆情况：\n" + rsp + "\n\n"
     if rsp3 != "": msg = msg + "今日gym情况：\n" + rsp3 + "\n\n"
@@ -179,10 +186,11 @@ def download_moyu_file():
                 break
         except Exception as e:
             LOG.error(f"download_moyu_file Failed to fetch data. Retry count:{i}, Error:{e}")
-            time.sleep(5)
+        # 没拿到链接(报错或者还没发布)都退避一下再重试, 间隔指数增加带随机抖动, 最后一次不用等
+        if i < retry_count - 1:
+            time.sleep(min(30, 2 * 2 ** i) + random.uniform(0, 1))
     if file_url:
-        # 使用urllib.request库下载文件并保存到指定的位置
-        urllib.request.urlretrieve(file_url, full_file_path)
+        download_file("GET", file_url, full_file_path)
         LOG.info(f'{local_filename}已下载到 {download_directory}')
     else:
         LOG.error(f"未能获取到摸鱼文件的链接 {download_directory}")
@@ -207,14 +215,23 @@ def download_zao_bao_file():
     url = "https://v2.alapi.cn/api/zaobao"
     payload = "token=ODECJI71rCNDt6DO&format=image"
     headers = {'Content-Type': "application/x-www-form-urlencoded"}
-    response = requests.request("POST", url, data=payload, headers=headers)
-
-    # 保存到指定的位置
-    with open(full_file_path, 'wb') as file:
-        file.write(response.content)
+    download_file("POST", url, full_file_path, data=payload, headers=headers)
     LOG.info(f'{local_filename} 已下载到 {download_directory}')
 
 
+def download_file(method, url, full_file_path, **kwargs):
+    """
+    流式下载分块写盘, 不把整张图片读进内存; 先写临时文件, 写完再改名, 避免发出去半张图
+    """
+    tmp_file_path = full_file_path + '.part'
+    with requests.request(method, url, stream=True, timeout=(5, 60), **kwargs) as response:
+        response.raise_for_status()
+        with open(tmp_file_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                file.write(chunk)
+    os.replace(tmp_file_path, full_file_path)
+
+
 @log_function_execution
 def async_download_zao_bao_file():
     executor.submit(download_zao_bao_file)
@@ -226,10 +243,6 @@ def async_download_moyu_file():
 
 
 def get_moyu_url_by_wx():
-    import requests
-
-    from bs4 import BeautifulSoup
-
     url = "https://mp.weixin.qq.com/mp/appmsgalbum?action=getalbum&album_id=2190548434338807809"
     # 发送 POST 请求
     response = requests.get(url)
@@ -294,7 +307,6 @@ def get_current_date_utc8():
 
 
 def check_image_openable(image_path):
-    from PIL import Image
     try:
         # 尝试打开图片
         with Image.open(image_path) as img:
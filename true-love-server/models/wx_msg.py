@@ -2,6 +2,8 @@
 import re
 from datetime import datetime
 
+at_all_pattern = re.compile(r"@(?:所有人|all|All)")
+
 
 class WxMsgServer:
     """微信消息
@@ -16,6 +18,9 @@ class WxMsgServer:
         thumb (str): 视频或图片消息的缩略图路径
         extra (str): 视频或图片消息的路径
     """
+    # 每条消息都会new一个, 用slots省掉实例__dict__
+    __slots__ = ("_is_self", "_is_group", "type", "id", "ts", "sign", "xml", "sender", "roomid", "content", "thumb",
+                 "extra", "refer_chat")
 
     def __init__(self, msg: dict) -> None:
         self._is_self = msg.get("_is_self")
@@ -57,7 +62,7 @@ class WxMsgServer:
         if not re.findall(f"<atuserlist>.*({wxid}).*</atuserlist>", self.xml):
             return False  # 不在 @ 清单里
 
-        if re.findall(r"@(?:所有人|all|All)", self.content):
+        if at_all_pattern.search(self.content):
             return False  # 排除 @ 所有人
 
         return True
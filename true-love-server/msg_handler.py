@@ -2,8 +2,9 @@ import json
 import logging
 import re
 
+import requests
+
 import context_vars
-from asr_utils import do_asr
 from chat_msg_handler import ChatMsgHandler
 from models.wx_msg import WxMsgServer
 from trig_remainder_handler import TrigRemainderHandler
@@ -12,6 +13,9 @@ from trig_task_handler import TrigTaskHandler
 
 handler = ChatMsgHandler()
 LOG = logging.getLogger("MsgHandler")
+# 正则在模块加载时编译一次, 每条消息都会用到
+url_pattern = re.compile(r'https?://[^\s]+')
+markdown_link_pattern = re.compile(r'\(http.*?\)')
 
 class MsgHandler:
 
@@ -70,9 +74,8 @@ class MsgHandler:
         if msg.refer_chat and (msg.refer_chat['type'] in [34]
                                or (msg.refer_chat['type'] == 6
                                    and ('m4a' in msg.refer_chat['content'] or 'mp3' in msg.refer_chat['content']))):
-            q = f"{q}, quoted asr recognition content content:{do_asr(msg.refer_chat['content'])}"
-            return handler.get_answer(q, (msg.roomid if msg.from_group() else msg.sender),
-                                      msg.sender)
+            return handler.get_asr_answer(q, msg.refer_chat['content'],
+                                          (msg.roomid if msg.from_group() else msg.sender), msg.sender)
         # 其他引用类型说不支持
         if msg.refer_chat:
             return "啊哦~ 现在这个类型引用我还看不懂, 不如你把内容复制出来给我看看呢"
@@ -95,15 +98,14 @@ class MsgHandler:
 
         # 如果是语音消息, 那么去asr一下
         if msg.type == 34:
-            return handler.get_answer(do_asr(msg.content), (msg.roomid if msg.from_group() else msg.sender),
-                                      msg.sender)
+            return handler.get_asr_answer('', msg.content, (msg.roomid if msg.from_group() else msg.sender),
+                                          msg.sender)
         # 其他类型
         return "啊哦~ 现在这个消息暂时我还看不懂, 但我会持续学习的~"
 
     @staticmethod
     def extract_first_link(text):
         # 正则表达式用于检测文本中的所有URL
-        url_pattern = re.compile(r'https?://[^\s]+')
         match = url_pattern.search(text)
         if match:
             return match.group()  # 返回第一个匹配的链接
@@ -114,13 +116,12 @@ class MsgHandler:
         if url == "" or url is None:
             return ""
         try:
-            import requests
             request_url = "https://r.jina.ai/" + url
             headers = {'Accept': 'application/json', 'User-Agent': 'PostmanRuntime/7.40.0'}
             response = requests.get(url=request_url, headers=headers)
             response_data = response.json()
-            return re.sub(r'\(http.*?\)', '', response_data['data']['content']).replace('[]', '').replace('\n\n',
-                                                                                                          '\n').strip()
+            content = markdown_link_pattern.sub('', response_data['data']['content'])
+            return content.replace('[]', '').replace('\n\n', '\n').strip()
         except Exception:
             logging.exception(f"crawl_content error, url:{url}")
             return '内容解析失败'
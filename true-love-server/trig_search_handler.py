@@ -6,6 +6,8 @@ import pytz
 import requests
 from bs4 import BeautifulSoup
 
+from configuration import Config
+
 
 class TrigSearchHandler:
     def __init__(self):
@@ -159,7 +161,7 @@ class TrigSearchHandler:
             # 将结果列表转换为单个字符串，每个条目之间用两个换行符分隔
             res = "今日巴黎奥运赛事速看:" + "\n\n" + "\n".join(result)
         else:
-            logging.error(F"Failed to retrieve search_aoyun_news data: {response.text}")
+            logging.error("Failed to retrieve search_aoyun_news data: %s", response.text[:500])
 
         return res
 
@@ -182,43 +184,10 @@ class TrigSearchHandler:
             # 将结果列表转换为单个字符串，每个条目之间用两个换行符分隔
             res = f"奥运奖牌排行榜({data['tplData']['data']['tabsList'][0]['subTitle']}):" + "\n\n" + "\n".join(result)
         else:
-            logging.error(F"Failed to retrieve search_aoyun_medal data: {response.text}")
+            logging.error("Failed to retrieve search_aoyun_medal data: %s", response.text[:500])
 
         return res
 
-    def search_aoyuan(self) -> str:
-        url = "https://srh.bankofchina.com/search/whpj/search_cn.jsp"
-        payload = 'erectDate=&nothing=&pjname=%E6%BE%B3%E5%A4%A7%E5%88%A9%E4%BA%9A%E5%85%83&head=head_620.js&bottom=bottom_591.js'
-        headers = {
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Cookie': 'JSESSIONID=00001CdOkfmL1j6G9cXi9ak2N4F:-1',
-            'Origin': 'https://srh.bankofchina.com',
-            'Pragma': 'no-cache',
-            'Referer': 'https://srh.bankofchina.com/search/whpj/search_cn.jsp',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'same-origin',
-            'Sec-Fetch-User': '?1',
-            'Upgrade-Insecure-Requests': '1',
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36',
-            'sec-ch-ua': '"Chromium";v="116", "Not)A;Brand";v="24", "Google Chrome";v="116"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"macOS"'
-        }
-
-        response = requests.request("POST", url, headers=headers, data=payload)
-        s = BeautifulSoup(response.text, features="html.parser").text
-        s1 = s.strip().split('澳大利亚元')[2].strip().replace(' ', '')
-        arr = s1.split('\n')
-        str = '现汇买入价:' + arr[0].strip() + ',\n现钞买入价:' + arr[2].strip() + ',\n现汇卖出价:' + arr[
-            4].strip() + ',\n现钞卖出价:' + arr[6].strip() + ',\n中行折算价:' + arr[8].strip() + ',\n发布时间:' + arr[
-                  10].strip()
-        return str
-
     def gym_schedule(self):
         url = "https://www.google.com/search?gl=us&tbm=map&q=Keating+Sports+Center%2C+Keating+Sports+Center%2C+South+Wabash+Avenue%2C+Chicago%2C+IL&nfpr=1&pb=!4m8!1m3!1d2771.238802426475!2d-87.6255606!3d41.8390215!3m2!1i375!2i358!4f13.1!7i20!10b1!12m14!1m1!18b1!17m4!1e1!1e0!3e1!3e0!20m5!1e0!2e3!3b0!5e2!6b1!26b1!19m4!2m3!1i335!2i120!4i8!20m35!3m1!2i9!6m6!1m2!1i375!2i124!1m2!1i622!2i75!7m24!1m3!1e1!2b0!3e3!1m3!1e2!2b1!3e2!1m3!1e2!2b0!3e3!1m3!1e8!2b0!3e3!1m3!1e10!2b0!3e3!1m3!1e10!2b1!3e2!9b0!22m7!4m1!2i22236!7e140!9sqKEsZfqKF4Ls9AOftpCACA%3A972177539594!17sqKEsZfqKF4Ls9AOftpCACA%3A972177539595!24m1!2e1!24m29!1m2!18m1!17b1!4b1!11m2!3e1!3e0!17b1!20m2!1e3!1e1!24b1!29b1!71b1!72m13!1m5!1b1!2b1!3b1!5b1!7b1!4b0!8m4!1m2!4m1!1e1!3sother_user_reviews!9b1!89b1!26m7!1e12!1e15!1e13!1e3!2m2!1i80!2i80!28sBChIJV9cIunMsDogRqx7m556ious%3D!34m5!9b1!12b1!14b1!25b1!26b1!37m1!1e140!49m3!6m2!1b1!2b1!69i666"
         headers = {
@@ -236,7 +205,6 @@ class TrigSearchHandler:
             'x-maps-diversion-context-bin': 'CAI='
         }
         try:
-            from configuration import Config
             proxy = Config().LLM_BOT.get("proxy")
             response = requests.request("GET", url, headers=headers, data={}, proxies={"http": proxy, "https": proxy})
             json_str = response.text
@@ -2,6 +2,7 @@ import json
 import logging
 import random
 import sqlite3
+from contextlib import closing
 from datetime import datetime
 
 import requests
@@ -255,23 +256,22 @@ class TrigTaskHandler:
         if ":" in question:
             device_id = question.split(":")[1].strip()
 
-        conn = sqlite3.connect('mc_devices.db')
-        cursor = conn.cursor()
-        if device_id:
-            # 如果提供了device_id，更新或插入记录
-            cursor.execute('REPLACE INTO mc_devices (sender, device_id) VALUES (?, ?)', (sender, device_id))
-            conn.commit()
-        else:
-            # 尝试从数据库获取device_id
-            cursor.execute('SELECT device_id FROM mc_devices WHERE sender = ?', (sender,))
-            row = cursor.fetchone()
-            if row:
-                device_id = row[0]
+        # closing保证sql报错时连接也会被关闭, 不会泄露文件句柄
+        with closing(sqlite3.connect('mc_devices.db')) as conn:
+            cursor = conn.cursor()
+            if device_id:
+                # 如果提供了device_id，更新或插入记录
+                cursor.execute('REPLACE INTO mc_devices (sender, device_id) VALUES (?, ?)', (sender, device_id))
+                conn.commit()
             else:
-                # 如果没有找到记录，并且没有提供device_id
-                conn.close()
-                return "首次使用, 需要带上设备id, 否则无法在你的设备完成登陆, 格式: 执行发号:xxx, 其中xxx为你的设备id"
-        conn.close()
+                # 尝试从数据库获取device_id
+                cursor.execute('SELECT device_id FROM mc_devices WHERE sender = ?', (sender,))
+                row = cursor.fetchone()
+                if row:
+                    device_id = row[0]
+                else:
+                    # 如果没有找到记录，并且没有提供device_id
+                    return "首次使用, 需要带上设备id, 否则无法在你的设备完成登陆, 格式: 执行发号:xxx, 其中xxx为你的设备id"
         return device_id
 
 